@@ -1,21 +1,70 @@
 import sqlite3
 import os
+import logging
+import queue
+import threading
+import time
+
+import orjson
+
+# A single connection is shared by every request. sqlite3 connections are not
+# safe to drive from several threads at once, so statements go through _lock.
+_CONN = None
+_CONN_PATH = None
+_lock = threading.RLock()
+
+# Audit rows are written by a background thread so requests never wait on a
+# commit. Rows are grouped into one transaction per batch.
+_log_queue = queue.Queue()
+_writer_thread = None
+_writer_lock = threading.Lock()
+_BATCH_SIZE = 100
+_BATCH_INTERVAL = 0.05
+# Queued by flush() so the writer commits what it has without waiting out the interval
+_FLUSH = object()
+
+_INSERT_LOG = """
+    INSERT INTO audit_logs (event_type, input, findings, risk_score)
+    VALUES (?, ?, ?, ?)
+"""
+
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA mmap_size=268435456",
+)
 
 def _db_path():
     return os.environ.get("DATABASE_NAME", "privacy_assistant.db")
 
 
 def get_connection():
+    """Return the shared connection, reopening it if DATABASE_NAME changed."""
+    global _CONN, _CONN_PATH
     db_name = _db_path()
-    conn = sqlite3.connect(db_name, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
+    with _lock:
+        if _CONN is None or _CONN_PATH != db_name:
+            close_connection()
+            conn = sqlite3.connect(db_name, check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            for pragma in _PRAGMAS:
+                conn.execute(pragma)
+            _CONN, _CONN_PATH = conn, db_name
+        return _CONN
+
+def close_connection():
+    global _CONN, _CONN_PATH
+    with _lock:
+        if _CONN is not None:
+            _CONN.close()
+        _CONN, _CONN_PATH = None, None
 
 def create_table():
-    conn = get_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute(
+    with _lock:
+        conn = get_connection()
+        conn.execute(
             """
             CREATE TABLE IF NOT EXISTS audit_logs(
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -27,30 +76,77 @@ def create_table():
             )
             """
         )
-        conn.commit()
-    finally:
-        conn.close()
+        # Lets get_logs() read rows in timestamp order instead of sorting the table
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_audit_logs_ts ON audit_logs(timestamp DESC)")
 
-def add_log(event_type, input_text, findings, risk_score):
-    conn = get_connection()
+def _write_batch(rows):
+    with _lock:
+        conn = get_connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(_INSERT_LOG, rows)
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+def _writer_loop():
+    while True:
+        batch = [_log_queue.get()]
+        deadline = time.monotonic() + _BATCH_INTERVAL
+        while len(batch) < _BATCH_SIZE and batch[-1] is not _FLUSH:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(_log_queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        rows = [row for row in batch if row is not _FLUSH]
+        try:
+            if rows:
+                _write_rows(rows)
+        finally:
+            for _ in batch:
+                _log_queue.task_done()
+
+def _write_rows(batch):
     try:
-        with conn:
-            conn.execute(
-                """
-                INSERT INTO audit_logs (event_type, input, findings, risk_score)
-                VALUES (?, ?, ?, ?)
-                """,
-                (event_type, input_text, str(findings), risk_score),
-            )
-    finally:
-        conn.close()
+        _write_batch(batch)
+    except Exception:
+        if len(batch) == 1:
+            logging.exception("Failed to write audit log row for %r event", batch[0][0])
+            return
+        # Retry one row at a time so a bad row only loses its own entry
+        for row in batch:
+            _write_rows([row])
+
+def _ensure_writer():
+    global _writer_thread
+    if _writer_thread is not None and _writer_thread.is_alive():
+        return
+    with _writer_lock:
+        if _writer_thread is None or not _writer_thread.is_alive():
+            _writer_thread = threading.Thread(target=_writer_loop, name="audit-log-writer", daemon=True)
+            _writer_thread.start()
+
+def add_log(event_type, input_text, findings, risk_score):
+    """Queue an audit log row; it is committed by the background writer."""
+    _ensure_writer()
+    # Stored as JSON so the column can be queried with SQLite's json_extract()
+    findings_json = orjson.dumps(findings).decode()
+    _log_queue.put_nowait((event_type, input_text, findings_json, risk_score))
+
+def flush():
+    """Block until every queued audit log row has been written."""
+    _ensure_writer()
+    _log_queue.put_nowait(_FLUSH)
+    _log_queue.join()
 
 def get_logs():
-    conn = get_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, event_type, input, findings, risk_score, timestamp FROM audit_logs ORDER BY timestamp DESC")
-        rows = cursor.fetchall()
-        return [dict(row) for row in rows]
-    finally:
-        conn.close()
+    flush()
+    with _lock:
+        rows = get_connection().execute(
+            "SELECT id, event_type, input, findings, risk_score, timestamp FROM audit_logs ORDER BY timestamp DESC"
+        ).fetchall()
+    return [dict(row) for row in rows]
@@ -1,5 +1,17 @@
 """File text extraction utilities."""
+import codecs
 import io
+from typing import BinaryIO, Iterator
+
+_STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def _latin1_fallback(err: UnicodeDecodeError):
+    # Bytes that aren't valid UTF-8 are read as latin-1, which accepts any byte
+    return err.object[err.start:err.end].decode('latin1'), err.end
+
+
+codecs.register_error('pii_latin1_fallback', _latin1_fallback)
 
 
 def extract_text_from_file(content: bytes, filename: str) -> str:
@@ -17,22 +29,66 @@ def extract_text_from_file(content: bytes, filename: str) -> str:
         return _decode_text(content)
 
 
+def extract_text_from_file_stream(reader: BinaryIO, filename: str) -> Iterator[str]:
+    """Yield text from a binary stream piece by piece; joining the pieces gives the full text.
+
+    Peak memory stays around one chunk of input for text files and one page or
+    paragraph for PDF/DOCX. Unparseable PDF/DOCX content ends the stream early.
+    """
+    if isinstance(reader, io.RawIOBase):
+        reader = io.BufferedReader(reader, buffer_size=_STREAM_CHUNK_SIZE)
+
+    filename_lower = (filename or '').lower()
+
+    if filename_lower.endswith('.pdf'):
+        return _join_lines(_iter_pdf_pages(reader))
+    elif filename_lower.endswith('.docx'):
+        return _join_lines(_iter_docx_text(reader))
+    else:
+        return _iter_decoded(reader)
+
+
 def _decode_text(content: bytes) -> str:
-    """Decode bytes to text with fallback encodings."""
-    for encoding in ['utf-8', 'latin1', 'cp1252']:
-        try:
-            return content.decode(encoding)
-        except UnicodeDecodeError:
-            continue
-    return ""
+    """Decode bytes as UTF-8, falling back to latin-1 (which accepts any byte)."""
+    try:
+        return content.decode('utf-8')
+    except UnicodeDecodeError:
+        return content.decode('latin1')
+
+
+def _iter_decoded(stream: BinaryIO) -> Iterator[str]:
+    """Decode a stream chunk by chunk as UTF-8, reading invalid bytes as latin-1."""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='pii_latin1_fallback')
+    for chunk in iter(lambda: stream.read(_STREAM_CHUNK_SIZE), b''):
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+def _join_lines(parts: Iterator[str]) -> Iterator[str]:
+    """Yield parts with newlines between them, stopping quietly if the parser fails."""
+    try:
+        for i, part in enumerate(parts):
+            yield '\n' + part if i else part
+    except Exception:
+        return
+
+
+def _iter_pdf_pages(stream: BinaryIO) -> Iterator[str]:
+    """Yield the text of each PDF page, parsing pages only as they are reached."""
+    from pypdf import PdfReader
+    reader = PdfReader(stream)
+    for page in reader.pages:
+        yield page.extract_text()
 
 
 def _extract_pdf_text(content: bytes) -> str:
     """Extract text from PDF content."""
     try:
-        from pypdf import PdfReader
-        reader = PdfReader(io.BytesIO(content))
-        return '\n'.join(page.extract_text() for page in reader.pages)
+        return '\n'.join(_iter_pdf_pages(io.BytesIO(content)))
     except Exception:
         return ""
 
@@ -40,16 +96,21 @@ def _extract_pdf_text(content: bytes) -> str:
 def _extract_docx_text(content: bytes) -> str:
     """Extract text from DOCX content."""
     try:
-        from docx import Document
-        doc = Document(io.BytesIO(content))
-        
-        text_parts = [p.text for p in doc.paragraphs]
-        
-        # Extract table text
-        for table in doc.tables:
-            for row in table.rows:
-                text_parts.extend(cell.text for cell in row.cells)
-        
-        return '\n'.join(text_parts)
+        return '\n'.join(_iter_docx_text(io.BytesIO(content)))
     except Exception:
-        return ""
\ No newline at end of file
+        return ""
+
+
+def _iter_docx_text(stream: BinaryIO) -> Iterator[str]:
+    """Yield the text of each DOCX paragraph, then of each table cell."""
+    from docx import Document
+    doc = Document(stream)
+
+    for p in doc.paragraphs:
+        yield p.text
+
+    # Extract table text
+    for table in doc.tables:
+        for row in table.rows:
+            for cell in row.cells:
+                yield cell.text
@@ -1,16 +1,18 @@
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
 import uvicorn
 import os
 import logging
+import threading
 
 try:
-    from .pii_scanner import scan_text, redact_text, score_privacy_risk
-    from .file_utils import extract_text_from_file
+    from .pii_scanner import scan_text, redact_text, score_privacy_risk, warm_up
+    from .file_utils import extract_text_from_file_stream
     from . import db
 except ImportError:
-    from pii_scanner import scan_text, redact_text, score_privacy_risk
-    from file_utils import extract_text_from_file
+    from pii_scanner import scan_text, redact_text, score_privacy_risk, warm_up
+    from file_utils import extract_text_from_file_stream
     import db
 
 logging.basicConfig(level=logging.INFO)
@@ -24,6 +26,14 @@ app = FastAPI(title="AI-Powered Data Privacy Assistant",
 def startup_event():
     logging.info("Creating DB tables on startup using DATABASE_NAME=%s", os.environ.get("DATABASE_NAME"))
     db.create_table()
+    # Load models in the background so the first request doesn't pay for it
+    if os.environ.get("PII_PRELOAD_MODELS", "1") != "0":
+        threading.Thread(target=warm_up, name="model-warm-up", daemon=True).start()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    db.flush()
+    db.close_connection()
 
 @app.post("/scan")
 async def scan_endpoint(request: Request):
@@ -38,10 +48,11 @@ async def scan_endpoint(request: Request):
             text = form.get("text") or ""
         except Exception:
             text = ""
-    findings = scan_text(text)
+    findings = await run_in_threadpool(scan_text, text)
     risk_score = score_privacy_risk(findings)
-    db.add_log('scan', text, findings, risk_score)
-    return JSONResponse(content={"findings": findings, "risk_score": risk_score})
+    finding_dicts = [f.to_dict() for f in findings]
+    db.add_log('scan', text, finding_dicts, risk_score)
+    return JSONResponse(content={"findings": finding_dicts, "risk_score": risk_score})
 
 @app.post("/redact")
 async def redact_endpoint(request: Request):
@@ -56,32 +67,40 @@ async def redact_endpoint(request: Request):
             text = form.get("text") or ""
         except Exception:
             text = ""
-    redacted = redact_text(text)
-    findings = scan_text(redacted)
+    findings = await run_in_threadpool(scan_text, text)
+    redacted = redact_text(text, findings=findings)
     risk_score = score_privacy_risk(findings)
-    db.add_log('redact', text, findings, risk_score)
-    return JSONResponse(content={"redacted_text": redacted, "findings": findings, "risk_score": risk_score})
+    finding_dicts = [f.to_dict() for f in findings]
+    db.add_log('redact', text, finding_dicts, risk_score)
+    return JSONResponse(content={"redacted_text": redacted, "findings": finding_dicts, "risk_score": risk_score})
+
+def _extract_upload(file: UploadFile) -> str:
+    """Stream the spooled upload straight into the extractor."""
+    return "".join(extract_text_from_file_stream(file.file, file.filename or ""))
 
 @app.post("/upload")
 async def upload_endpoint(file: UploadFile = File(...)):
-    contents = await file.read()
-    text = extract_text_from_file(contents, file.filename or "")
+    text = await run_in_threadpool(_extract_upload, file)
     
-    findings = scan_text(text)
+    findings = await run_in_threadpool(scan_text, text)
     risk_score = score_privacy_risk(findings)
-    db.add_log('upload', text, findings, risk_score)
+    finding_dicts = [f.to_dict() for f in findings]
+    db.add_log('upload', text, finding_dicts, risk_score)
     
     return JSONResponse(content={
         "message": "uploaded", 
         "filename": file.filename, 
-        "findings": findings, 
+        "findings": finding_dicts, 
         "risk_score": risk_score
     })
 
 @app.get("/logs")
 async def get_logs():
-    logs = db.get_logs()
+    logs = await run_in_threadpool(db.get_logs)
     return JSONResponse(content={"logs": logs})
 
+def _main() -> None:
+    uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    _main()
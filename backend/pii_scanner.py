@@ -1,6 +1,50 @@
 
+import hashlib
+import os
 import re
-from typing import List, Dict
+import queue
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from typing import List, Dict, Optional, Tuple
+
+# google-re2 guarantees linear-time matching and is much faster than the
+# backtracking `re` engine on large documents; fall back when it's missing.
+try:
+    import re2 as _regex_engine
+except ImportError:
+    _regex_engine = re
+
+# blake3 is a SIMD cryptographic hash, several times faster than blake2b on
+# the texts we fingerprint for the scan cache.
+try:
+    from blake3 import blake3 as _blake3
+except ImportError:
+    _blake3 = None
+
+
+@dataclass(slots=True)
+class Finding:
+    type: str
+    value: str
+    start: Optional[int]
+    end: Optional[int]
+    source: str
+    confidence: float
+
+    def to_dict(self) -> Dict:
+        return {
+            "type": self.type,
+            "value": self.value,
+            "start": self.start,
+            "end": self.end,
+            "source": self.source,
+            "confidence": self.confidence,
+        }
+
 
 _SPACY_AVAILABLE = None
 _spacy = None
@@ -17,8 +61,6 @@ def _check_spacy():
             _spacy = None
     return _SPACY_AVAILABLE
 
-_check_spacy()
-
 _TRANSFORMERS_AVAILABLE = None
 pipeline = None
 
@@ -37,36 +79,113 @@ def _check_transformers():
 _HF_NER = None
 _HF_CLASSIFIER = None
 
+# int8 ONNX exports of the NER model are cached here so only the first start
+# pays for export + quantization.
+_ONNX_CACHE_DIR = os.environ.get("PII_ONNX_CACHE_DIR", os.path.join("models", "onnx-int8"))
+
+
+# Smallest model first; set PII_NER_MODEL to opt into a heavier one.
+_NER_MODELS = (
+    "dslim/distilbert-NER",
+    "dslim/bert-base-NER",
+    "dbmdz/bert-large-cased-finetuned-conll03-english",
+)
+
+
+def _ner_model_candidates():
+    preferred = os.environ.get("PII_NER_MODEL")
+    if not preferred:
+        return _NER_MODELS
+    return (preferred,) + tuple(m for m in _NER_MODELS if m != preferred)
+
+
+def _load_quantized_ner(model_name: str):
+    """Build an int8 ONNX Runtime NER pipeline; needs `optimum[onnxruntime]`."""
+    from optimum.onnxruntime import ORTModelForTokenClassification, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+
+    save_dir = os.path.join(_ONNX_CACHE_DIR, model_name.replace("/", "--"))
+    if not os.path.exists(os.path.join(save_dir, "model_quantized.onnx")):
+        ORTModelForTokenClassification.from_pretrained(model_name, export=True).save_pretrained(save_dir)
+        AutoTokenizer.from_pretrained(model_name).save_pretrained(save_dir)
+        quantizer = ORTQuantizer.from_pretrained(save_dir)
+        qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+        quantizer.quantize(save_dir=save_dir, quantization_config=qconfig)
+    model = ORTModelForTokenClassification.from_pretrained(save_dir, file_name="model_quantized.onnx")
+    tokenizer = AutoTokenizer.from_pretrained(save_dir)
+    return pipeline("ner", model=model, tokenizer=tokenizer, grouped_entities=True)
+
+
+def _load_ner_pipeline(model_name: str):
+    try:
+        return _load_quantized_ner(model_name)
+    except Exception:
+        return pipeline("ner", model=model_name, grouped_entities=True)
+
+
+_hf_init_lock = threading.Lock()
+
 
 def _init_hf_models():
     global _HF_NER, _HF_CLASSIFIER
     if not _check_transformers():
         return
-    if _HF_NER is None:
-        try:
-            _HF_NER = pipeline("ner", model="dbmdz/bert-large-cased-finetuned-conll03-english", grouped_entities=True)
-        except Exception:
+    # Startup warm-up and the first request may both get here
+    with _hf_init_lock:
+        if _HF_NER is None:
+            for model_name in _ner_model_candidates():
+                try:
+                    _HF_NER = _load_ner_pipeline(model_name)
+                    break
+                except Exception:
+                    continue
+        if _HF_CLASSIFIER is None:
             try:
-                _HF_NER = pipeline("ner", model="dslim/bert-base-NER", grouped_entities=True)
+                _HF_CLASSIFIER = pipeline("zero-shot-classification", model="facebook/bart-large-mnli")
             except Exception:
-                _HF_NER = None
-    if _HF_CLASSIFIER is None:
-        try:
-            _HF_CLASSIFIER = pipeline("zero-shot-classification", model="facebook/bart-large-mnli")
-        except Exception:
-            _HF_CLASSIFIER = None
+                _HF_CLASSIFIER = None
+
+
+def _reset_hf_state():
+    """Forget the loaded HF pipelines so the next scan loads them from scratch."""
+    global _HF_NER, _HF_CLASSIFIER, _TRANSFORMERS_AVAILABLE, pipeline
+    _HF_NER = None
+    _HF_CLASSIFIER = None
+    _TRANSFORMERS_AVAILABLE = None
+    pipeline = None
 
 _SPACY_NLP = None
+# Only the entity recognizer's output is used
+_SPACY_DISABLED = ["tagger", "parser", "attribute_ruler", "lemmatizer"]
+
+_spacy_init_lock = threading.Lock()
 
 def _load_spacy_model():
     global _SPACY_NLP
     if _SPACY_NLP is None and _check_spacy():
-        try:
-            _SPACY_NLP = _spacy.load("en_core_web_sm")
-        except Exception:
-            _SPACY_NLP = None
+        with _spacy_init_lock:
+            if _SPACY_NLP is None:
+                try:
+                    _SPACY_NLP = _spacy.load("en_core_web_sm", disable=_SPACY_DISABLED)
+                except Exception:
+                    _SPACY_NLP = None
     return _SPACY_NLP
 
+
+def _reset_spacy_state():
+    """Forget the loaded spaCy model so the next scan imports and loads it again."""
+    global _SPACY_NLP, _SPACY_AVAILABLE, _spacy
+    _SPACY_NLP = None
+    _SPACY_AVAILABLE = None
+    _spacy = None
+
+
+def warm_up():
+    """Load the spaCy and HF models now instead of on the first request."""
+    _load_spacy_model()
+    _init_hf_models()
+
 PII_PATTERNS = {
     "email": re.compile(r"[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}"),
     "phone": re.compile(r"\b\d{3}[-.\s]?\d{3}[-.\s]?\d{4}\b"),
@@ -74,41 +193,199 @@ PII_PATTERNS = {
     "credit_card": re.compile(r"\b\d{4}[-\s]?\d{4}[-\s]?\d{4}[-\s]?\d{4}\b")
 }
 
+# All patterns as one alternation so a scan is a single pass over the text.
+# The named group that matched gives the PII type.
+_PII_REGEX = _regex_engine.compile("|".join(f"(?P<{name}>{p.pattern})" for name, p in PII_PATTERNS.items()))
+
 
-def _regex_scan(text: str) -> List[Dict]:
+def _regex_scan(text: str) -> List[Finding]:
     results = []
-    for pii_type, pattern in PII_PATTERNS.items():
-        for m in pattern.finditer(text):
-            results.append({
-                "type": pii_type,
-                "value": m.group(0),
-                "start": m.start(),
-                "end": m.end(),
-                "source": "regex",
-                "confidence": 0.9
-            })
+    for m in _PII_REGEX.finditer(text):
+        results.append(Finding(
+            type=m.lastgroup,
+            value=m.group(0),
+            start=m.start(),
+            end=m.end(),
+            source="regex",
+            confidence=0.9,
+        ))
     return results
 
 
-def _spacy_scan(text: str) -> List[Dict]:
+# HF NER models only see ~512 tokens, so longer texts are split on sentence
+# boundaries into windows of at most 400 wordpieces, counted with the
+# pipeline's own tokenizer, and scanned as a batch. Without a tokenizer that
+# reports offsets, windows fall back to a character budget sized for
+# digit-heavy text (phone/card lists run ~2 characters per wordpiece). spaCy
+# has no such limit but gets much larger windows to bound per-doc memory.
+_NER_CHUNK_TOKENS = 400
+_NER_CHUNK_CHARS = 800
+_SPACY_CHUNK_CHARS = 100_000
+_SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+")
+# The pipeline turns truncation on for every call and counting turns it off, and
+# a fast tokenizer raises "Already borrowed" if that changes mid-encode, so
+# counting and pipeline calls on different threads take turns.
+_hf_tokenizer_lock = threading.Lock()
+
+
+def _chunk_text(text: str, max_size: int = _NER_CHUNK_CHARS,
+                token_starts: Optional[List[int]] = None) -> List[Tuple[int, str]]:
+    """Split text into (offset, chunk) windows of at most max_size, breaking between sentences.
+
+    Sizes are in characters, or in tokens when token_starts (the start offset
+    of every token, in order) is given.
+    """
+    if token_starts is None:
+        def size(s, e):
+            return e - s
+
+        def cut(s):
+            return s + max_size
+    else:
+        def size(s, e):
+            return bisect_left(token_starts, e) - bisect_left(token_starts, s)
+
+        def cut(s):
+            return max(token_starts[bisect_left(token_starts, s) + max_size], s + 1)
+
+    if size(0, len(text)) <= max_size:
+        return [(0, text)]
+    sentences = []
+    pos = 0
+    for m in _SENTENCE_BREAK.finditer(text):
+        sentences.append((pos, m.start()))
+        pos = m.end()
+    sentences.append((pos, len(text)))
+
+    chunks = []
+    chunk_start = chunk_end = 0
+    for s, e in sentences:
+        if size(chunk_start, e) <= max_size:
+            chunk_end = e
+            continue
+        if chunk_end > chunk_start:
+            chunks.append((chunk_start, text[chunk_start:chunk_end]))
+        # A single sentence longer than the window is cut into fixed slices
+        while size(s, e) > max_size:
+            c = cut(s)
+            chunks.append((s, text[s:c]))
+            s = c
+        chunk_start, chunk_end = s, e
+    if chunk_end > chunk_start:
+        chunks.append((chunk_start, text[chunk_start:chunk_end]))
+    return chunks
+
+
+def _ner_chunks(text: str) -> List[Tuple[int, str]]:
+    """Split text for the HF NER model, counting wordpieces with its tokenizer when possible."""
+    # Every token covers at least one character, so short texts fit as they are
+    if len(text) <= _NER_CHUNK_TOKENS:
+        return [(0, text)]
+    tokenizer = getattr(_HF_NER, "tokenizer", None)
+    if tokenizer is not None:
+        try:
+            with _hf_tokenizer_lock:
+                enc = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)
+            token_starts = [start for start, _ in enc["offset_mapping"]]
+        except Exception:
+            # Slow tokenizers can't report offsets
+            token_starts = None
+        if token_starts is not None:
+            return _chunk_text(text, _NER_CHUNK_TOKENS, token_starts)
+    return _chunk_text(text, _NER_CHUNK_CHARS)
+
+
+def _spacy_scan(text: str) -> List[Finding]:
     results = []
     nlp = _load_spacy_model()
     if not nlp:
         return results
-    doc = nlp(text)
-    for ent in doc.ents:
-        results.append({
-            "type": ent.label_.lower(),
-            "value": ent.text,
-            "start": ent.start_char,
-            "end": ent.end_char,
-            "source": "spacy",
-            "confidence": getattr(ent, "kb_id", 0.8) or 0.8
-        })
+    chunks = _chunk_text(text, _SPACY_CHUNK_CHARS)
+    if len(chunks) == 1:
+        docs = [(0, nlp(text))]
+    else:
+        docs = zip((offset for offset, _ in chunks), nlp.pipe((chunk for _, chunk in chunks), batch_size=32))
+    for offset, doc in docs:
+        for ent in doc.ents:
+            results.append(Finding(
+                type=ent.label_.lower(),
+                value=ent.text,
+                start=ent.start_char + offset,
+                end=ent.end_char + offset,
+                source="spacy",
+                confidence=getattr(ent, "kb_id", 0.8) or 0.8,
+            ))
     return results
 
 
-def _hf_ner_scan(text: str) -> List[Dict]:
+# Concurrent _hf_ner_scan calls are queued and run through the pipeline as
+# one batch, instead of each request padding its own batch of one.
+_HF_BATCH_SIZE = 16
+_HF_BATCH_WAIT = 0.01
+_HF_TIMEOUT = 60.0
+_hf_queue = queue.Queue()
+_hf_batcher = None
+_hf_batcher_lock = threading.Lock()
+
+
+def _hf_batch_loop():
+    while True:
+        batch = [_hf_queue.get()]
+        deadline = time.monotonic() + _HF_BATCH_WAIT
+        while len(batch) < _HF_BATCH_SIZE:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(_hf_queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        _run_hf_batch(batch)
+
+
+def _run_hf_batch(batch: List[Tuple[str, Future]]) -> None:
+    texts = [text for text, _ in batch]
+    try:
+        with _hf_tokenizer_lock:
+            if len(texts) == 1:
+                outputs = [_HF_NER(texts[0])]
+            else:
+                outputs = _HF_NER(texts, batch_size=len(texts))
+        if len(outputs) != len(texts):
+            raise ValueError(f"NER pipeline returned {len(outputs)} results for {len(texts)} texts")
+    except Exception as exc:
+        if len(batch) == 1:
+            batch[0][1].set_exception(exc)
+            return
+        # Rerun each text on its own so a bad input only fails its own request
+        for item in batch:
+            _run_hf_batch([item])
+        return
+    for (_, fut), ents in zip(batch, outputs):
+        fut.set_result(ents)
+
+
+def _submit_hf(text: str) -> Future:
+    global _hf_batcher
+    if _hf_batcher is None or not _hf_batcher.is_alive():
+        with _hf_batcher_lock:
+            if _hf_batcher is None or not _hf_batcher.is_alive():
+                _hf_batcher = threading.Thread(target=_hf_batch_loop, name="hf-ner-batcher", daemon=True)
+                _hf_batcher.start()
+    fut = Future()
+    _hf_queue.put((text, fut))
+    return fut
+
+
+class _DetectorError(Exception):
+    """A detector failed part-way through a text; `findings` holds what it found first."""
+
+    def __init__(self, findings: List[Finding]):
+        super().__init__("detector failed")
+        self.findings = findings
+
+
+def _hf_ner_scan(text: str, raise_errors: bool = False) -> List[Finding]:
     results = []
     if _HF_NER is None:
         try:
@@ -118,59 +395,123 @@ def _hf_ner_scan(text: str) -> List[Dict]:
     if not _HF_NER:
         return results
     try:
-        ents = _HF_NER(text)
-        for ent in ents:
-            ent_type = ent.get("entity_group") or ent.get("entity")
-            results.append({
-                "type": str(ent_type).lower(),
-                "value": ent.get("word") or ent.get("word", ""),
-                "start": ent.get("start"),
-                "end": ent.get("end"),
-                "source": "hf_ner",
-                "confidence": float(ent.get("score", 0.0))
-            })
-    except Exception:
-        pass
+        pending = [(offset, _submit_hf(chunk)) for offset, chunk in _ner_chunks(text)]
+        for offset, fut in pending:
+            for ent in fut.result(timeout=_HF_TIMEOUT):
+                ent_type = ent.get("entity_group") or ent.get("entity")
+                start, end = ent.get("start"), ent.get("end")
+                results.append(Finding(
+                    type=str(ent_type).lower(),
+                    value=ent.get("word") or ent.get("word", ""),
+                    start=start + offset if start is not None else None,
+                    end=end + offset if end is not None else None,
+                    source="hf_ner",
+                    confidence=float(ent.get("score", 0.0)),
+                ))
+    except Exception as exc:
+        if raise_errors:
+            raise _DetectorError(results) from exc
     return results
 
 
-def _dedupe_findings(findings: List[Dict]) -> List[Dict]:
-    seen = set()
+def _dedupe_findings(findings: List[Finding]) -> List[Finding]:
+    # Sorting on the full key puts identical findings next to each other, so a
+    # single sweep against the previous one drops duplicates without a seen-set.
+    # Overlapping findings of different types are kept; redact_text merges spans.
     out = []
-    for f in sorted(findings, key=lambda x: (x.get("start") or 0, -(x.get("end") or 0))):
-        key = (f.get("type"), f.get("value"), f.get("start"), f.get("end"))
-        if key in seen:
-            continue
-        seen.add(key)
-        out.append(f)
+    prev = None
+    for f in sorted(findings, key=lambda x: (x.start or 0, -(x.end or 0), x.type or "", x.value or "")):
+        key = (f.type, f.value, f.start, f.end)
+        if key != prev:
+            out.append(f)
+            prev = key
     return out
 
 
-def scan_text(text: str, use_spacy: bool = True, use_hf: bool = True, use_regex: bool = True) -> List[Dict]:
-    findings: List[Dict] = []
-    if use_regex:
-        findings.extend(_regex_scan(text))
+# Shared by all requests; each scan_text call uses at most two workers.
+_DETECTOR_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="pii-detector")
+
+
+def _scan_text_uncached(text: str, use_spacy: bool, use_hf: bool, use_regex: bool) -> Tuple[List[Finding], bool]:
+    """Run the enabled detectors; the flag is False if one of them failed on this text."""
+    findings: List[Finding] = []
+    complete = True
+    # spaCy and HF NER spend their time in native code, so they run alongside
+    # each other while the (sub-millisecond) regex pass runs on this thread.
+    futures = []
     if use_spacy:
-        findings.extend(_spacy_scan(text))
+        futures.append(_DETECTOR_POOL.submit(_spacy_scan, text))
     if use_hf:
-        findings.extend(_hf_ner_scan(text))
+        futures.append(_DETECTOR_POOL.submit(_hf_ner_scan, text, True))
+    if use_regex:
+        findings.extend(_regex_scan(text))
+    for fut in futures:
+        try:
+            findings.extend(fut.result())
+        except _DetectorError as exc:
+            findings.extend(exc.findings)
+            complete = False
 
     try:
-        if _HF_CLASSIFIER is None:
+        if use_hf and _HF_CLASSIFIER is None:
             _init_hf_models()
     except Exception:
-        return _dedupe_findings(findings)
+        pass
+
+    return _dedupe_findings(findings), complete
+
+
+# Repeated texts (demo examples, resubmitted tickets) are answered from an LRU
+# cache instead of rerunning the detectors. The key includes the loaded models
+# so results computed before a model finished loading aren't served after.
+_SCAN_CACHE: "OrderedDict[tuple, List[Finding]]" = OrderedDict()
+_SCAN_CACHE_SIZE = 1024
+_SCAN_CACHE_MAX_TEXT = 64 * 1024
+_scan_cache_lock = threading.Lock()
+
+
+def _fingerprint(text: str) -> bytes:
+    data = text.encode("utf-8", "surrogatepass")
+    if _blake3 is not None:
+        return _blake3(data).digest(length=16)
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def _scan_cache_key(text: str, use_spacy: bool, use_hf: bool, use_regex: bool) -> tuple:
+    return (_fingerprint(text), use_spacy, use_hf, use_regex, id(_SPACY_NLP), id(_HF_NER))
+
+
+def scan_text(text: str, use_spacy: bool = True, use_hf: bool = True, use_regex: bool = True) -> List[Finding]:
+    key = None
+    if len(text) <= _SCAN_CACHE_MAX_TEXT:
+        key = _scan_cache_key(text, use_spacy, use_hf, use_regex)
+        with _scan_cache_lock:
+            cached = _SCAN_CACHE.get(key)
+            if cached is not None:
+                _SCAN_CACHE.move_to_end(key)
+                return [replace(f) for f in cached]
+
+    findings, complete = _scan_text_uncached(text, use_spacy, use_hf, use_regex)
 
-    return _dedupe_findings(findings)
+    # A detector that errored (e.g. an HF timeout) would otherwise leave its
+    # missing findings cached until the entry is evicted
+    if key is not None and complete:
+        with _scan_cache_lock:
+            _SCAN_CACHE[key] = [replace(f) for f in findings]
+            _SCAN_CACHE.move_to_end(key)
+            if len(_SCAN_CACHE) > _SCAN_CACHE_SIZE:
+                _SCAN_CACHE.popitem(last=False)
+    return findings
 
 
-def redact_text(text: str, placeholder: str = "[REDACTED]") -> str:
-    findings = scan_text(text)
-    spans = [(f.get("start"), f.get("end")) for f in findings if f.get("start") is not None and f.get("end") is not None]
+def redact_text(text: str, placeholder: str = "[REDACTED]", findings: Optional[List[Finding]] = None) -> str:
+    if findings is None:
+        findings = scan_text(text)
+    spans = [(f.start, f.end) for f in findings if f.start is not None and f.end is not None]
     if not spans:
-        for pattern in PII_PATTERNS.values():
-            text = pattern.sub(placeholder, text)
-        return text
+        # Defensive fallback for findings from a scan without regex enabled.
+        # A function replacement keeps backslashes in the placeholder literal.
+        return _PII_REGEX.sub(lambda m: placeholder, text)
 
     spans = sorted(spans, key=lambda x: x[0])
     merged = []
@@ -190,12 +531,12 @@ def redact_text(text: str, placeholder: str = "[REDACTED]") -> str:
     return "".join(parts)
 
 
-def score_privacy_risk(findings: List[Dict]) -> int:
+def score_privacy_risk(findings: List[Finding]) -> int:
     if not findings:
         return 0
     score = 0
     for f in findings:
-        t = (f.get("type") or "").lower()
+        t = (f.type or "").lower()
         if t in ["ssn", "credit_card"]:
             score += 35
         elif t in ["email", "phone"]:
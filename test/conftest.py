@@ -1,4 +1,5 @@
 import os
+import queue
 import sys
 import pytest
 
@@ -7,8 +8,111 @@ if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
 
+# Test databases are throwaway, so skip the WAL file and every fsync
+_TEST_PRAGMAS = (
+    "PRAGMA journal_mode=MEMORY",
+    "PRAGMA synchronous=OFF",
+    "PRAGMA temp_store=MEMORY",
+)
+_APP_PRAGMAS = None
+
+
+@pytest.fixture(scope="session", autouse=True)
+def test_env(tmp_path_factory):
+    """Point the app at a throwaway database for the whole run."""
+    global _APP_PRAGMAS
+    import backend.db as db
+    _APP_PRAGMAS = db._PRAGMAS
+    mp = pytest.MonkeyPatch()
+    mp.setenv("DATABASE_NAME", str(tmp_path_factory.mktemp("db") / "test.sqlite"))
+    mp.setattr(db, "_PRAGMAS", _TEST_PRAGMAS)
+    # Don't load real models in the background while tests swap in mocks
+    mp.setenv("PII_PRELOAD_MODELS", "0")
+    yield
+    mp.undo()
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _warm_models(test_env):
+    """Load spaCy and the HF pipelines once per worker instead of in the first test that needs them."""
+    import backend.pii_scanner as ps
+    ps.warm_up()
+    yield
+
+
+@pytest.fixture
+def app_pragmas(monkeypatch, tmp_path):
+    """Open a fresh database with the pragmas the app uses outside tests."""
+    import backend.db as db
+    monkeypatch.setattr(db, "_PRAGMAS", _APP_PRAGMAS)
+    monkeypatch.setenv("DATABASE_NAME", str(tmp_path / "app_pragmas.sqlite"))
+
+
+@pytest.fixture(scope="session")
+def client(test_env):
+    """One TestClient for the run, so app startup/shutdown happen once."""
+    from fastapi.testclient import TestClient
+    from backend.main import app
+    with TestClient(app) as c:
+        yield c
+
+
+_DB_POOL_SIZE = 4
+
+
+@pytest.fixture(scope="session")
+def _db_pool(test_env, tmp_path_factory):
+    """Sqlite files created once with the schema and reused across tests."""
+    import backend.db as db
+    pool = queue.Queue()
+    pool_dir = tmp_path_factory.mktemp("db_pool")
+    mp = pytest.MonkeyPatch()
+    for i in range(_DB_POOL_SIZE):
+        path = str(pool_dir / f"pool_{i}.sqlite")
+        mp.setenv("DATABASE_NAME", path)
+        db.create_table()
+        pool.put(path)
+    mp.undo()
+    return pool
+
+
+@pytest.fixture
+def pooled_db(_db_pool, monkeypatch):
+    """Point DATABASE_NAME at a pooled database, emptied when handed back."""
+    import backend.db as db
+    path = _db_pool.get()
+    monkeypatch.setenv("DATABASE_NAME", path)
+    try:
+        yield path
+    finally:
+        db.flush()
+        # DATABASE_NAME may have been changed again by the test
+        monkeypatch.setenv("DATABASE_NAME", path)
+        with db._lock:
+            db.get_connection().execute("DELETE FROM audit_logs")
+        _db_pool.put(path)
+
+
+@pytest.fixture(autouse=True)
+def clean_db():
+    # Audit rows are committed by the background writer on a shared
+    # connection, so tests are isolated by emptying the table afterwards
+    # rather than by rolling back a wrapping transaction.
+    yield
+    db = sys.modules.get("backend.db")
+    if db is None:
+        return
+    db.flush()
+    with db._lock:
+        conn = db.get_connection()
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'audit_logs'").fetchone():
+            conn.execute("DELETE FROM audit_logs")
+
+
 @pytest.fixture(autouse=True)
-def isolate_db(tmp_path, monkeypatch):
-    db_path = tmp_path / "test_db.sqlite"
-    monkeypatch.setenv("DATABASE_NAME", str(db_path))
+def clear_scan_cache():
+    # Tests swap detector mocks between runs over the same text
     yield
+    ps = sys.modules.get("backend.pii_scanner")
+    if ps is not None:
+        ps._SCAN_CACHE.clear()